@@ -1,4 +1,4 @@
-from .mongodb import mongo_db, users_collection
+from .mongodb import MongoDB, get_mongo_db
 from .user_repository import UserRepository
 
-__all__ = ["mongo_db", "users_collection", "UserRepository"]
\ No newline at end of file
+__all__ = ["MongoDB", "get_mongo_db", "UserRepository"]
\ No newline at end of file
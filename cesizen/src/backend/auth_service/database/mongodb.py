@@ -2,47 +2,64 @@ from pymongo import MongoClient
 from pymongo.database import Database
 from pymongo.collection import Collection
 import os
-from typing import Optional
+from typing import Dict, Optional
 
 # MongoDB connection parameters — use environment variables in production
 MONGO_HOST = os.environ.get("MONGO_HOST", "mongo")
 MONGO_PORT = os.environ.get("MONGO_PORT", "27017")
 MONGO_URI = os.environ.get("MONGO_URI", f"mongodb://{MONGO_HOST}:{MONGO_PORT}/")
 DB_NAME = os.environ.get("MONGO_DB_NAME", "cesizen_auth")
+MONGO_POOL_SIZE = int(os.environ.get("MONGO_POOL_SIZE", "10"))
 
-# Singleton pattern for MongoDB connection
+# Singleton pattern for MongoDB connection. The client itself is created
+# lazily and once per process, so that no socket is ever shared across a fork
 class MongoDB:
     _instance: Optional["MongoDB"] = None
-    _client: Optional[MongoClient] = None
-    _db: Optional[Database] = None
+    _clients: Dict[int, MongoClient] = {}
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(MongoDB, cls).__new__(cls)
-            cls._client = MongoClient(MONGO_URI)
-            cls._db = cls._client[DB_NAME]
         return cls._instance
 
+    @classmethod
+    def _get_client(cls) -> MongoClient:
+        pid = os.getpid()
+        client = cls._clients.get(pid)
+        if client is None:
+            client = MongoClient(
+                MONGO_URI,
+                maxPoolSize=MONGO_POOL_SIZE,
+                minPoolSize=1,
+                connect=False,
+                serverSelectionTimeoutMS=3000,
+                retryWrites=True,
+                uuidRepresentation="standard",
+            )
+            cls._clients[pid] = client
+        return client
+
     @property
     def client(self) -> MongoClient:
-        return self._client
+        return self._get_client()
 
     @property
     def db(self) -> Database:
-        return self._db
+        return self.client[DB_NAME]
+
+    @property
+    def users(self) -> Collection:
+        return self.get_collection("users")
 
     def get_collection(self, collection_name: str) -> Collection:
-        return self._db[collection_name]
+        return self.db[collection_name]
 
     def close(self):
-        if self._client:
-            self._client.close()
-            MongoDB._client = None
-            MongoDB._db = None
-            MongoDB._instance = None
+        client = MongoDB._clients.pop(os.getpid(), None)
+        if client:
+            client.close()
 
-# Create a MongoDB connection instance
-mongo_db = MongoDB()
 
-# Get collections
-users_collection = mongo_db.get_collection("users")
\ No newline at end of file
+def get_mongo_db() -> MongoDB:
+    """Return the MongoDB connection manager for the current process"""
+    return MongoDB()
\ No newline at end of file
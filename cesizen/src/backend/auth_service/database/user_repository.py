@@ -1,23 +1,67 @@
-from typing import Optional, Dict, Any, List
+import os
+from typing import Optional, Dict, Any, List, Callable
+from pymongo import ASCENDING, IndexModel
 from pymongo.collection import Collection
-from .mongodb import users_collection
+from .mongodb import get_mongo_db
 from passlib.context import CryptContext
 from pydantic import BaseModel
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Memory used by each argon2 hash or verification, in KiB
+ARGON2_MEMORY_COST_KIB = 65536
+
+# Password hashing context: new hashes use argon2id, bcrypt hashes still verify
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=int(os.environ.get("BCRYPT_ROUNDS", "10")),
+    argon2__time_cost=2,
+    argon2__memory_cost=ARGON2_MEMORY_COST_KIB,
+    argon2__parallelism=1,
+)
+
+# Fields that must never leave the repository outside of authentication
+PUBLIC_PROJECTION = {"_id": 0, "hashed_password": 0}
+
+# Only the fields needed to authenticate a user and build its token
+AUTH_PROJECTION = {
+    "_id": 0,
+    "username": 1,
+    "hashed_password": 1,
+    "role": 1,
+    "disabled": 1,
+    "email": 1,
+    "full_name": 1,
+}
 
 class UserRepository:
-    def __init__(self, collection: Collection = users_collection):
-        self.collection = collection
+    def __init__(
+        self,
+        collection: Optional[Collection] = None,
+        on_user_changed: Optional[Callable[[str], None]] = None,
+    ):
+        self._collection = collection
+        # Called with the username after every update or delete, so callers
+        # can drop anything they cached about that user
+        self.on_user_changed = on_user_changed
+
+    @property
+    def collection(self) -> Collection:
+        """The users collection, resolved on first use in the current process"""
+        if self._collection is None:
+            return get_mongo_db().users
+        return self._collection
 
     def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
-        """Retrieve a user by username from the database"""
-        return self.collection.find_one({"username": username})
+        """Retrieve a user by username from the database, without its password hash"""
+        return self.collection.find_one({"username": username}, PUBLIC_PROJECTION)
+
+    def get_auth_record(self, username: str) -> Optional[Dict[str, Any]]:
+        """Retrieve the fields needed to authenticate a user, including its hash"""
+        return self.collection.find_one({"username": username}, AUTH_PROJECTION)
 
     def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
-        """Retrieve a user by email from the database"""
-        return self.collection.find_one({"email": email})
+        """Retrieve a user by email from the database, without its password hash"""
+        return self.collection.find_one({"email": email}, PUBLIC_PROJECTION)
 
     def create_user(self, user_data: Dict[str, Any]) -> str:
         """Create a new user in the database"""
@@ -46,16 +90,25 @@ class UserRepository:
             {"username": username}, 
             {"$set": user_data}
         )
+        self._notify_user_changed(username)
         return result.modified_count > 0
 
     def delete_user(self, username: str) -> bool:
         """Delete a user from the database"""
         result = self.collection.delete_one({"username": username})
+        self._notify_user_changed(username)
         return result.deleted_count > 0
 
+    def _notify_user_changed(self, username: str):
+        """Tell the registered listener that a user was modified"""
+        if self.on_user_changed is not None:
+            self.on_user_changed(username)
+
     def list_users(self, skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
         """List all users with pagination"""
-        return list(self.collection.find().skip(skip).limit(limit))
+        return list(
+            self.collection.find({}, PUBLIC_PROJECTION).skip(skip).limit(limit)
+        )
 
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
         """Verify a password against its hash"""
@@ -63,8 +116,23 @@ class UserRepository:
 
     def create_index(self):
         """Create indexes for the user's collection"""
-        self.collection.create_index("username", unique=True)
-        self.collection.create_index("email", unique=True)
+        # Email is optional and stored as null when missing, so only enforce
+        # uniqueness on documents that actually carry an address
+        self.collection.create_indexes([
+            IndexModel([("username", ASCENDING)], unique=True, background=True),
+            IndexModel(
+                [("email", ASCENDING)],
+                name="email_unique_present",
+                unique=True,
+                background=True,
+                partialFilterExpression={"email": {"$type": "string"}},
+            ),
+        ])
+        # Databases created before the partial index still hold the plain
+        # unique one; it is dropped only once its replacement is built, so
+        # email uniqueness is enforced throughout the migration
+        if "email_1" in self.collection.index_information():
+            self.collection.drop_index("email_1")
 
     def init_admin_user(self, admin_username: str, admin_password: str, admin_email: str):
         """Initialize an administrator user if it doesn't exist yet"""
@@ -0,0 +1,106 @@
+"""
+Lightweight JWT helpers for HMAC-signed tokens.
+
+This module is kept identical in every service that handles tokens, since
+each service is built from its own directory.
+"""
+import binascii
+import hashlib
+import hmac
+import json
+import time
+from typing import Any, Dict
+
+from jose import JWTError
+from jose.exceptions import ExpiredSignatureError, JWTClaimsError
+from jose.utils import base64url_decode, base64url_encode
+
+_HMAC_DIGESTS = {
+    "HS256": hashlib.sha256,
+    "HS384": hashlib.sha384,
+    "HS512": hashlib.sha512,
+}
+
+
+class JWTCodec:
+    """
+    Encode and verify JWTs for a fixed HMAC key and algorithm.
+
+    The key, digest and encoded header are prepared once, so that each
+    token only costs one HMAC plus the base64 and JSON work. Decoding
+    raises the same python-jose exceptions as `jose.jwt.decode`.
+    """
+
+    def __init__(self, secret_key: str, algorithm: str = "HS256"):
+        if algorithm not in _HMAC_DIGESTS:
+            raise ValueError(f"Unsupported JWT algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self._key = secret_key.encode()
+        self._digest = _HMAC_DIGESTS[algorithm]
+        header = {"alg": algorithm, "typ": "JWT"}
+        self._encoded_header = base64url_encode(
+            json.dumps(header, separators=(",", ":")).encode()
+        )
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        return hmac.new(self._key, signing_input, self._digest).digest()
+
+    def encode(self, claims: Dict[str, Any]) -> str:
+        """
+        Sign the given claims into a compact JWT.
+
+        Args:
+            claims: JSON-serializable claims, with `exp` as a Unix timestamp.
+
+        Returns:
+            The encoded token.
+        """
+        encoded_payload = base64url_encode(
+            json.dumps(claims, separators=(",", ":")).encode()
+        )
+        signing_input = self._encoded_header + b"." + encoded_payload
+        signature = base64url_encode(self._sign(signing_input))
+        return (signing_input + b"." + signature).decode()
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        """
+        Verify a token and return its claims.
+
+        Args:
+            token: The encoded token.
+
+        Returns:
+            The token claims.
+
+        Raises:
+            JWTError: If the token is malformed, badly signed or expired, or
+                lacks a valid `exp` or `sub` claim
+        """
+        try:
+            signing_input, encoded_signature = token.encode().rsplit(b".", 1)
+            encoded_header, encoded_payload = signing_input.split(b".", 1)
+            header = json.loads(base64url_decode(encoded_header))
+            signature = base64url_decode(encoded_signature)
+        except (ValueError, binascii.Error):
+            raise JWTError("Invalid token")
+
+        if not isinstance(header, dict) or header.get("alg") != self.algorithm:
+            raise JWTError("Invalid token algorithm")
+        if not hmac.compare_digest(signature, self._sign(signing_input)):
+            raise JWTError("Signature verification failed")
+
+        try:
+            payload = json.loads(base64url_decode(encoded_payload))
+        except (ValueError, binascii.Error):
+            raise JWTError("Invalid token payload")
+        if not isinstance(payload, dict):
+            raise JWTError("Invalid token payload")
+
+        exp = payload.get("exp")
+        if isinstance(exp, bool) or not isinstance(exp, (int, float)):
+            raise JWTClaimsError("Expiration Time claim (exp) is required")
+        if exp < time.time():
+            raise ExpiredSignatureError("Signature has expired")
+        if not isinstance(payload.get("sub"), str):
+            raise JWTClaimsError("Subject claim (sub) is required")
+        return payload
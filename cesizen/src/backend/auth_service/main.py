@@ -1,15 +1,22 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr, Field
-from datetime import datetime, timedelta
+from datetime import timedelta
 from typing import Optional, List, Dict, Any
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from jose import JWTError
+from pymongo.errors import DuplicateKeyError
+from cachetools import TTLCache
+import asyncio
+import hashlib
+import threading
+import time
 import uvicorn
 import os
-from database.user_repository import UserRepository
-from database.mongodb import mongo_db
+from database.user_repository import ARGON2_MEMORY_COST_KIB, UserRepository, pwd_context
+from database.mongodb import get_mongo_db
+from jwt_utils import JWTCodec
 
 # Configuration - Use environment variables in production
 SECRET_KEY = os.environ.get("SECRET_KEY", "YOUR_SECRET_KEY_HERE")
@@ -18,10 +25,22 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES",
 ADMIN_USERNAME = os.environ.get("ADMIN_USERNAME", "admin")
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "admin")
 ADMIN_EMAIL = os.environ.get("ADMIN_EMAIL", "admin@example.com")
-
-# Initialize user repository
-user_repository = UserRepository()
-
+CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.environ.get("CORS_ORIGINS", "http://localhost").split(",")
+    if origin.strip()
+]
+DEFAULT_TOKEN_TTL_SECONDS = 15 * 60
+TOKEN_CACHE_TTL_SECONDS = 30
+USER_CACHE_TTL_SECONDS = 30
+PASSWORD_MAX_QUEUE = 500
+# Memory that concurrent password hashes may use together, since each argon2
+# operation holds ARGON2_MEMORY_COST_KIB; PASSWORD_HASH_CONCURRENCY overrides it
+PASSWORD_HASH_MEMORY_MB = int(os.environ.get("PASSWORD_HASH_MEMORY_MB", "256"))
+PASSWORD_HASH_CONCURRENCY = int(os.environ.get(
+    "PASSWORD_HASH_CONCURRENCY",
+    max(1, PASSWORD_HASH_MEMORY_MB * 1024 // ARGON2_MEMORY_COST_KIB),
+))
 
 # Models
 class Token(BaseModel):
@@ -98,13 +117,123 @@ class UserInDB(UserBase):
 
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# JWT signing and verification, with the key and header prepared once
+jwt_codec = JWTCodec(SECRET_KEY, ALGORITHM)
+
+# Password hashing is CPU and memory bound: run it off the event loop with
+# bounded concurrency
+PASSWORD_HASH_SEM = asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY)
+_password_queue = 0
+
+# Verified tokens, keyed by token hash: (token data, user, token expiry timestamp)
+_token_cache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL_SECONDS)
+# Resolved users, keyed by username
+_user_cache = TTLCache(maxsize=5000, ttl=USER_CACHE_TTL_SECONDS)
+# Count of invalidations, of any user, so that a lookup racing with an update
+# or delete does not store the record it read before the change
+_cache_generation = 0
+_cache_lock = threading.Lock()
+
+
+def _token_cache_key(token: str) -> str:
+    """Return the cache key for a raw bearer token."""
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+def invalidate_user_caches(username: str):
+    """
+    Drop the cached user and every cached token resolved to that user.
+
+    Registered as the repository's change listener, so that this process'
+    caches never serve a stale role or disabled flag after an update or
+    delete. Bumping the cache generation also keeps lookups already in
+    flight from caching the record they read before the change.
+
+    Args:
+        username: The username whose cached entries should be discarded.
+    """
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        _user_cache.pop(username, None)
+        stale_keys = [
+            key for key, (_, user, _) in _token_cache.items()
+            if user.username == username
+        ]
+        for key in stale_keys:
+            _token_cache.pop(key, None)
+
+
+# Initialize user repository
+user_repository = UserRepository(on_user_changed=invalidate_user_caches)
+
+
+async def _run_password_task(func, *args):
+    """
+    Run a password hashing function in the default thread pool.
+
+    Args:
+        func: The hashing or verification callable to run.
+        *args: Positional arguments passed to the callable.
+
+    Returns:
+        The callable's return value.
+
+    Raises:
+        HTTPException: If too many password operations are already queued
+    """
+    global _password_queue
+    if _password_queue > PASSWORD_MAX_QUEUE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    _password_queue += 1
+    try:
+        async with PASSWORD_HASH_SEM:
+            return await asyncio.to_thread(func, *args)
+    finally:
+        _password_queue -= 1
+
+
+async def hash_password_async(password: str) -> str:
+    """
+    Hash a password without blocking the event loop.
+
+    Args:
+        password: The plain text password to hash.
+
+    Returns:
+        The password hash.
+    """
+    return await _run_password_task(pwd_context.hash, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    Verify a password against its hash without blocking the event loop.
+
+    Args:
+        plain_password: The password provided by the user.
+        hashed_password: The stored password hash.
+
+    Returns:
+        True if the password matches, otherwise False.
+    """
+    return await _run_password_task(
+        user_repository.verify_password, plain_password, hashed_password
+    )
+
 
 def get_user(username: str):
     """
     Fetches a user from the MongoDB by their username.
+
+    Users are kept in a short-lived cache, invalidated by the repository
+    whenever the user is updated or deleted.
     
     Args:
         username: The username of the user to retrieve.
@@ -112,13 +241,23 @@ def get_user(username: str):
     Returns:
         UserInDB object if the username exists, otherwise None.
     """
-    user_data = user_repository.get_user_by_username(username)
+    with _cache_lock:
+        user = _user_cache.get(username)
+    if user is not None:
+        return user
+
+    generation = _cache_generation
+    user_data = user_repository.get_auth_record(username)
     if user_data:
-        return UserInDB(**user_data)
+        user = UserInDB(**user_data)
+        with _cache_lock:
+            if _cache_generation == generation:
+                _user_cache[username] = user
+        return user
     return None
 
 
-def authenticate_user(username: str, password: str):
+async def authenticate_user(username: str, password: str):
     """
     Authenticates a user by verifying username and password.
     
@@ -129,11 +268,20 @@ def authenticate_user(username: str, password: str):
     Returns:
         User object if authentication is successful, otherwise False
     """
-    user = get_user(username)
+    user = await run_in_threadpool(get_user, username)
     if not user:
         return False
-    if not user_repository.verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return False
+
+    # Transparently migrate legacy hashes to the current scheme
+    if pwd_context.needs_update(user.hashed_password):
+        user.hashed_password = await hash_password_async(password)
+        await run_in_threadpool(
+            user_repository.update_user,
+            user.username,
+            {"hashed_password": user.hashed_password},
+        )
     return user
 
 
@@ -156,11 +304,11 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """
     to_encode = data.copy()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        ttl_seconds = int(expires_delta.total_seconds())
     else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+        ttl_seconds = DEFAULT_TOKEN_TTL_SECONDS
+    to_encode.update({"exp": int(time.time()) + ttl_seconds})
+    encoded_jwt = jwt_codec.encode(to_encode)
     return encoded_jwt
 
 
@@ -182,8 +330,18 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cache_key = _token_cache_key(token)
+    with _cache_lock:
+        cached = _token_cache.get(cache_key)
+    if cached is not None:
+        _, user, expires_at = cached
+        if time.time() < expires_at:
+            return user
+        with _cache_lock:
+            _token_cache.pop(cache_key, None)
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt_codec.decode(token)
         username: str = payload.get("sub")
         role: str = payload.get("role", "user")
         if username is None:
@@ -192,9 +350,14 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
     
-    user = get_user(username=token_data.username)
+    generation = _cache_generation
+    user = await run_in_threadpool(get_user, token_data.username)
     if user is None:
         raise credentials_exception
+
+    with _cache_lock:
+        if _cache_generation == generation:
+            _token_cache[cache_key] = (token_data, user, payload["exp"])
     return user
 
 
@@ -247,7 +410,7 @@ app = FastAPI(
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # In production, specify actual origins
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -256,6 +419,9 @@ app.add_middleware(
 # Startup event to initialize DB
 @app.on_event("startup")
 async def startup_db_client():
+    # Create this worker's MongoDB client before any request can race for it
+    get_mongo_db().client
+
     # Create indexes
     user_repository.create_index()
     
@@ -269,7 +435,7 @@ async def startup_db_client():
 # Shutdown event to close DB connection
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    mongo_db.close()
+    get_mongo_db().close()
 
 # Authentication endpoints
 @app.post("/token", response_model=Token)
@@ -277,7 +443,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     """
     OAuth2 compatible token login, get an access token for future requests.
     """
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -297,29 +463,21 @@ async def create_user(user: UserCreate):
     """
     Create a new user.
     """
-    # Check if username already exists
-    existing_user = user_repository.get_user_by_username(user.username)
-    if existing_user:
+    # Create user, relying on the unique indexes to reject duplicates
+    user_data = user.dict()
+    user_data["hashed_password"] = await hash_password_async(user_data.pop("password"))
+    try:
+        await run_in_threadpool(user_repository.create_user, user_data)
+    except DuplicateKeyError as e:
+        key_pattern = (e.details or {}).get("keyPattern", {})
+        field = "Email" if "email" in key_pattern else "Username"
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already registered"
+            detail=f"{field} already registered"
         )
     
-    # Check if email already exists
-    if user.email:
-        existing_email = user_repository.get_user_by_email(user.email)
-        if existing_email:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already registered"
-            )
-    
-    # Create user
-    user_data = user.dict()
-    user_repository.create_user(user_data)
-    
     # Return user data without password
-    return {k: v for k, v in user_data.items() if k != "password"}
+    return {k: v for k, v in user_data.items() if k != "hashed_password"}
 
 @app.get("/users/me/", response_model=User)
 async def read_users_me(current_user: UserInDB = Depends(get_current_active_user)):
@@ -337,20 +495,29 @@ async def update_user_me(
     Update current user information.
     """
     # Filter out None values
-    update_data = {k: v for k, v in user_update.dict().items() if v is not None}
+    update_data = user_update.model_dump(exclude_unset=True, exclude_none=True)
     
     if update_data:
         # Check if email is being changed and already exists
         if "email" in update_data and update_data["email"] != current_user.email:
-            existing_email = user_repository.get_user_by_email(update_data["email"])
+            existing_email = await run_in_threadpool(
+                user_repository.get_user_by_email, update_data["email"]
+            )
             if existing_email:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Email already registered"
                 )
         
+        if "password" in update_data:
+            update_data["hashed_password"] = await hash_password_async(
+                update_data.pop("password")
+            )
+
         # Update user
-        success = user_repository.update_user(current_user.username, update_data)
+        success = await run_in_threadpool(
+            user_repository.update_user, current_user.username, update_data
+        )
         if not success:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -358,7 +525,7 @@ async def update_user_me(
             )
     
     # Return updated user
-    updated_user = get_user(current_user.username)
+    updated_user = await run_in_threadpool(get_user, current_user.username)
     return updated_user
 
 # Admin endpoints
@@ -371,7 +538,7 @@ async def list_users(
     """
     List all users. Admin only.
     """
-    users = user_repository.list_users(skip=skip, limit=limit)
+    users = await run_in_threadpool(user_repository.list_users, skip, limit)
     return users
 
 @app.get("/admin/users/{username}", response_model=User)
@@ -382,7 +549,7 @@ async def get_user_by_username(
     """
     Get a specific user by username. Admin only.
     """
-    user_data = user_repository.get_user_by_username(username)
+    user_data = await run_in_threadpool(user_repository.get_user_by_username, username)
     if not user_data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -400,7 +567,7 @@ async def admin_update_user(
     Update a specific user by username. Admin only.
     """
     # Check if user exists
-    user_data = user_repository.get_user_by_username(username)
+    user_data = await run_in_threadpool(user_repository.get_user_by_username, username)
     if not user_data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -408,20 +575,29 @@ async def admin_update_user(
         )
     
     # Filter out None values
-    update_data = {k: v for k, v in user_update.dict().items() if v is not None}
+    update_data = user_update.model_dump(exclude_unset=True, exclude_none=True)
     
     if update_data:
         # Check if email is being changed and already exists
         if "email" in update_data and update_data["email"] != user_data["email"]:
-            existing_email = user_repository.get_user_by_email(update_data["email"])
+            existing_email = await run_in_threadpool(
+                user_repository.get_user_by_email, update_data["email"]
+            )
             if existing_email and existing_email["username"] != username:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Email already registered"
                 )
         
+        if "password" in update_data:
+            update_data["hashed_password"] = await hash_password_async(
+                update_data.pop("password")
+            )
+
         # Update user
-        success = user_repository.update_user(username, update_data)
+        success = await run_in_threadpool(
+            user_repository.update_user, username, update_data
+        )
         if not success:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -429,7 +605,7 @@ async def admin_update_user(
             )
     
     # Return updated user
-    updated_user = get_user(username)
+    updated_user = await run_in_threadpool(get_user, username)
     return updated_user
 
 @app.delete("/admin/users/{username}", status_code=status.HTTP_204_NO_CONTENT)
@@ -448,7 +624,7 @@ async def delete_user(
         )
     
     # Delete user
-    success = user_repository.delete_user(username)
+    success = await run_in_threadpool(user_repository.delete_user, username)
     if not success:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -463,7 +639,7 @@ async def health_check():
     """
     try:
         # Verify database connection
-        mongo_db.client.admin.command('ping')
+        await run_in_threadpool(get_mongo_db().client.admin.command, 'ping')
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
         return {
@@ -1,14 +1,23 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Body, Query
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel, Field
-from jose import jwt, JWTError
-from typing import List, Optional
+from jose import JWTError
+from typing import Dict, List, Optional
+from collections import defaultdict
+from cachetools import TTLCache
+import bisect
+import hashlib
+import itertools
+import threading
+import time
 import uvicorn
 from datetime import datetime
+from jwt_utils import JWTCodec
 
 # Configuration
 SECRET_KEY = "YOUR_SECRET_KEY_HERE"  # Should match auth service key
 ALGORITHM = "HS256"
+TOKEN_CACHE_TTL_SECONDS = 30
 
 # Models
 class ContentBase(BaseModel):
@@ -32,6 +41,11 @@ class Content(ContentBase):
 
 # Security
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+jwt_codec = JWTCodec(SECRET_KEY, ALGORITHM)
+
+# Verified tokens, keyed by token hash: (current user dict, token expiry timestamp)
+_token_cache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL_SECONDS)
+_token_cache_lock = threading.Lock()
 
 # FastAPI app
 app = FastAPI(
@@ -62,6 +76,16 @@ fake_content_db = {
     }
 }
 
+# Content ids in insertion order, overall and per category, so listing
+# only touches the requested page instead of scanning every document
+_all_ids: List[str] = list(fake_content_db)
+_by_category: Dict[str, List[str]] = defaultdict(list)
+for _content_id, _content in fake_content_db.items():
+    _by_category[_content["category"]].append(_content_id)
+
+# Ids are never reused, even after a delete
+_id_counter = itertools.count(start=max(map(int, fake_content_db), default=0) + 1)
+
 # Dependency
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
@@ -69,15 +93,26 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cache_key = hashlib.sha256(token.encode()).hexdigest()[:32]
+    with _token_cache_lock:
+        cached = _token_cache.get(cache_key)
+    if cached is not None:
+        current_user, expires_at = cached
+        if time.time() < expires_at:
+            return current_user
+        with _token_cache_lock:
+            _token_cache.pop(cache_key, None)
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        return {"username": username, "role": payload.get("role", "user")}
+        payload = jwt_codec.decode(token)
     except JWTError:
         raise credentials_exception
 
+    current_user = {"username": payload["sub"], "role": payload.get("role", "user")}
+    with _token_cache_lock:
+        _token_cache[cache_key] = (current_user, payload["exp"])
+    return current_user
+
 async def get_admin_user(current_user: dict = Depends(get_current_user)):
     if current_user.get("role") != "admin":
         raise HTTPException(
@@ -94,12 +129,9 @@ async def list_content(
     limit: int = 10,
     _: dict = Depends(get_current_user)
 ):
-    content_list = list(fake_content_db.values())
+    content_ids = _by_category.get(category, []) if category else _all_ids
     
-    if category:
-        content_list = [c for c in content_list if c["category"] == category]
-    
-    return content_list[skip: skip + limit]
+    return [fake_content_db[c] for c in content_ids[skip: skip + limit]]
 
 @app.get("/content/{content_id}", response_model=Content)
 async def get_content(content_id: str, _: dict = Depends(get_current_user)):
@@ -113,7 +145,7 @@ async def create_content(
     content: ContentCreate,
     current_user: dict = Depends(get_admin_user)
 ):
-    content_id = str(len(fake_content_db) + 1)  # Replace with MongoDB ObjectId in production
+    content_id = str(next(_id_counter))  # Replace with MongoDB ObjectId in production
     now = datetime.utcnow()
     
     content_data = Content(
@@ -127,6 +159,8 @@ async def create_content(
     )
     
     fake_content_db[content_id] = content_data.dict()
+    _all_ids.append(content_id)
+    _by_category[content_data.category].append(content_id)
     
     return content_data
 
@@ -140,7 +174,13 @@ async def update_content(
         raise HTTPException(status_code=404, detail="Content not found")
     
     content_data = fake_content_db[content_id]
-    update_data = content_update.dict(exclude_unset=True)
+    update_data = content_update.model_dump(exclude_unset=True, exclude_none=True)
+    
+    new_category = update_data.get("category")
+    if new_category is not None and new_category != content_data["category"]:
+        _by_category[content_data["category"]].remove(content_id)
+        # Ids are increasing, so sorting by value keeps creation order
+        bisect.insort(_by_category[new_category], content_id, key=int)
     
     for field, value in update_data.items():
         content_data[field] = value
@@ -155,7 +195,9 @@ async def delete_content(content_id: str, _: dict = Depends(get_admin_user)):
     if content_id not in fake_content_db:
         raise HTTPException(status_code=404, detail="Content not found")
     
-    del fake_content_db[content_id]
+    content_data = fake_content_db.pop(content_id)
+    _all_ids.remove(content_id)
+    _by_category[content_data["category"]].remove(content_id)
     
     return None
 
@@ -1,16 +1,33 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List
+from typing import Dict, Optional
 import uvicorn
+import asyncio
+import hashlib
+import os
+import httpx
+import time
+import uuid
+from cachetools import TTLCache
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from datetime import datetime
 from jose import jwt, JWTError
 from fastapi.security import OAuth2PasswordBearer
-import requests
+from fastapi.security.utils import get_authorization_scheme_param
+from redis import asyncio as aioredis
+from redis.exceptions import WatchError
 
 # Configuration
 AUTH_SERVICE_URL = "http://auth-service:8000"  # In production, use service discovery
+AUTH_UDS = os.getenv("AUTH_UDS")  # Unix socket of a co-located auth service, if any
 SECRET_KEY = "YOUR_SECRET_KEY_HERE"  # Should match auth service key
 ALGORITHM = "HS256"
+TOKEN_CACHE_TTL_SECONDS = 30
+AUTH_SERVICE_RETRY_SECONDS = 10
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+USER_STREAM_BATCH_SIZE = 100
 
 # Models
 class UserBase(BaseModel):
@@ -35,72 +52,222 @@ class User(UserBase):
 # Security
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{AUTH_SERVICE_URL}/token")
 
+# Shared auth errors, raised with their traceback reset so that reusing the
+# same instance does not keep growing its traceback chain
+CREDENTIALS_EXC = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+FORBIDDEN_EXC = HTTPException(
+    status_code=status.HTTP_403_FORBIDDEN,
+    detail="Not enough permissions"
+)
+
+# While the auth service is unreachable, tokens are decoded locally right away
+# instead of waiting for every verification call to fail
+_auth_service_down_until = 0.0
+
+# Verified tokens, keyed by token hash: (current user dict, token expiry timestamp)
+_tok_cache = TTLCache(maxsize=10_000, ttl=TOKEN_CACHE_TTL_SECONDS)
+# Verifications in flight, keyed by token hash, so concurrent requests carrying
+# the same uncached token share a single call to the auth service
+_tok_inflight: Dict[str, asyncio.Task] = {}
+# User resolved from the request's bearer token by AuthMiddleware, if any
+_current_user: ContextVar[Optional[dict]] = ContextVar("current_user", default=None)
+
+# Shared HTTP client to the auth service, so connections are pooled and kept alive,
+# and Redis client holding the users, so every worker sees the same data
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    limits = httpx.Limits(max_keepalive_connections=50, max_connections=200)
+    if AUTH_UDS:
+        # Same host as the auth service: skip TCP and talk over its Unix socket
+        app.state.http = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(uds=AUTH_UDS, limits=limits),
+            base_url="http://auth",
+            timeout=5.0,
+        )
+    else:
+        app.state.http = httpx.AsyncClient(
+            base_url=AUTH_SERVICE_URL,
+            timeout=5.0,
+            limits=limits,
+        )
+    app.state.redis = aioredis.from_url(REDIS_URL)
+    yield
+    await app.state.http.aclose()
+    await app.state.redis.aclose()
+
 # FastAPI app
 app = FastAPI(
     title="CESIzen User Service",
     description="User management service for CESIzen application",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-# Mock database - Replace with MongoDB in production
-fake_users_db = {}
+# Users are stored in Redis as JSON under "user:{username}"
+def user_key(username: str) -> str:
+    return f"user:{username}"
+
+# Serialized admin user listing, dropped on every user write, and a generation
+# bumped by the same writes so a listing built meanwhile is not stored. Both are
+# kept outside the "user:*" namespace so the listing scan never picks them up
+USER_LISTING_KEY = "users:listing"
+USER_LISTING_GENERATION_KEY = "users:listing:generation"
+
+def token_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
 
 # Dependency
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+async def get_redis(request: Request) -> aioredis.Redis:
+    return request.app.state.redis
+
+async def resolve_current_user(request: Request, token: str):
+    cache_key = token_cache_key(token)
+    cached = _tok_cache.get(cache_key)
+    if cached is not None:
+        current_user, expires_at = cached
+        if time.time() < expires_at:
+            return current_user
+        _tok_cache.pop(cache_key, None)
+
+    task = _tok_inflight.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(resolve_token(request, token, cache_key))
+        _tok_inflight[cache_key] = task
+    # Shielded so that one cancelled request does not fail the others waiting
+    return await asyncio.shield(task)
+
+async def resolve_token(request: Request, token: str, cache_key: str):
     try:
-        # Verify token with auth service
-        response = requests.get(
-            f"{AUTH_SERVICE_URL}/verify-token",
-            headers={"Authorization": f"Bearer {token}"}
-        )
-        if response.status_code != 200:
-            raise credentials_exception
-        return response.json()
-    except Exception:
-        # Fallback: decode token locally (not as secure)
+        current_user = await verify_token(request, token)
+
+        # The token is verified at this point, so its own expiry can be trusted
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            username: str = payload.get("sub")
-            if username is None:
-                raise credentials_exception
-            return {"username": username, "role": payload.get("role", "user")}
+            expires_at = jwt.get_unverified_claims(token).get("exp")
         except JWTError:
-            raise credentials_exception
+            expires_at = None
+        if expires_at is not None:
+            _tok_cache[cache_key] = (current_user, expires_at)
+        return current_user
+    finally:
+        _tok_inflight.pop(cache_key, None)
+
+async def verify_token(request: Request, token: str):
+    global _auth_service_down_until
+    if time.monotonic() >= _auth_service_down_until:
+        try:
+            # Verify token with auth service
+            response = await request.app.state.http.get(
+                "/verify-token",
+                headers={"Authorization": f"Bearer {token}"}
+            )
+        except httpx.TransportError:
+            _auth_service_down_until = time.monotonic() + AUTH_SERVICE_RETRY_SECONDS
+        else:
+            # Any answer is authoritative: a rejected token (e.g. a disabled
+            # user) must not be accepted by the local fallback
+            if response.status_code != 200:
+                raise CREDENTIALS_EXC.with_traceback(None)
+            return response.json()
+
+    # Fallback, only while the auth service is unreachable: decode token
+    # locally (not as secure)
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        username: str = payload.get("sub")
+        if username is None:
+            raise CREDENTIALS_EXC.with_traceback(None)
+        return {"username": username, "role": payload.get("role", "user")}
+    except JWTError:
+        raise CREDENTIALS_EXC.with_traceback(None)
+
+class AuthMiddleware:
+    """Resolve the bearer token once per request, before routing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        current_user = None
+        request = Request(scope)
+        scheme, token = get_authorization_scheme_param(request.headers.get("authorization"))
+        if scheme.lower() == "bearer" and token:
+            try:
+                current_user = await resolve_current_user(request, token)
+            except HTTPException:
+                pass
+
+        reset_token = _current_user.set(current_user)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_user.reset(reset_token)
+
+app.add_middleware(AuthMiddleware)
+
+# The token itself is handled by AuthMiddleware, oauth2_scheme only rejects
+# requests without one and documents the scheme in OpenAPI
+async def get_current_user(_: str = Depends(oauth2_scheme)):
+    current_user = _current_user.get()
+    if current_user is None:
+        raise CREDENTIALS_EXC.with_traceback(None)
+    return current_user
 
 async def get_admin_user(current_user: dict = Depends(get_current_user)):
     if current_user.get("role") != "admin":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
+        raise FORBIDDEN_EXC.with_traceback(None)
     return current_user
 
 # Routes
 @app.post("/users/", response_model=User, status_code=status.HTTP_201_CREATED)
-async def create_user(user: UserCreate):
+async def create_user(
+    user: UserCreate,
+    request: Request,
+    redis: aioredis.Redis = Depends(get_redis)
+):
     # Check if username exists
-    if user.username in fake_users_db:
+    if await redis.exists(user_key(user.username)):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
     
-    # Create user in auth service
+    # Create user in auth service, in the background
+    register_task = asyncio.create_task(request.app.state.http.post(
+        "/register",
+        json={
+            "username": user.username,
+            "password": user.password,
+            "email": user.email,
+            "full_name": user.full_name
+        }
+    ))
+    
+    # Build this service's record before waiting on the auth service
     try:
-        auth_response = requests.post(
-            f"{AUTH_SERVICE_URL}/register",
-            json={
-                "username": user.username,
-                "password": user.password,
-                "email": user.email,
-                "full_name": user.full_name
-            }
+        now = datetime.utcnow()
+        user_data = User(
+            id=uuid.uuid4().hex,
+            username=user.username,
+            email=user.email,
+            full_name=user.full_name,
+            created_at=now,
+            updated_at=now
         )
+    except BaseException:
+        register_task.cancel()
+        raise
+    
+    try:
+        auth_response = await register_task
         if auth_response.status_code != 201:
             raise HTTPException(
                 status_code=auth_response.status_code,
@@ -113,49 +280,145 @@ async def create_user(user: UserCreate):
         )
     
     # Store user in this service's database
-    now = datetime.utcnow()
-    user_id = str(len(fake_users_db) + 1)  # Replace with MongoDB ObjectId in production
-    user_data = User(
-        id=user_id,
-        username=user.username,
-        email=user.email,
-        full_name=user.full_name,
-        created_at=now,
-        updated_at=now
-    )
-    fake_users_db[user.username] = user_data
+    user_json = user_data.model_dump_json()
+    async with redis.pipeline(transaction=True) as pipe:
+        created, _, _ = await (
+            pipe.set(user_key(user.username), user_json, nx=True)
+            .delete(USER_LISTING_KEY)
+            .incr(USER_LISTING_GENERATION_KEY)
+            .execute()
+        )
+    if not created:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already registered"
+        )
     
-    return user_data
+    # Returning a Response skips re-validating the freshly built User
+    return Response(
+        content=user_json,
+        status_code=status.HTTP_201_CREATED,
+        media_type="application/json"
+    )
 
 @app.get("/users/me", response_model=User)
-async def read_users_me(current_user: dict = Depends(get_current_user)):
-    if current_user["username"] not in fake_users_db:
+async def read_users_me(
+    current_user: dict = Depends(get_current_user),
+    redis: aioredis.Redis = Depends(get_redis)
+):
+    raw_user = await redis.get(user_key(current_user["username"]))
+    if raw_user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return fake_users_db[current_user["username"]]
+    # Stored value is User JSON validated by create_user or update_user_me
+    return Response(content=raw_user, media_type="application/json")
 
 @app.put("/users/me", response_model=User)
-async def update_user_me(user_update: UserUpdate, current_user: dict = Depends(get_current_user)):
-    if current_user["username"] not in fake_users_db:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user_data = fake_users_db[current_user["username"]]
-    update_data = user_update.dict(exclude_unset=True)
+async def update_user_me(
+    user_update: UserUpdate,
+    current_user: dict = Depends(get_current_user),
+    redis: aioredis.Redis = Depends(get_redis)
+):
+    key = user_key(current_user["username"])
+    update_data = user_update.model_dump(exclude_unset=True, exclude_none=True)
     
-    for field, value in update_data.items():
-        setattr(user_data, field, value)
-    
-    user_data.updated_at = datetime.utcnow()
-    fake_users_db[current_user["username"]] = user_data
+    # Optimistic read-modify-write: retry if the user changes under our feet,
+    # so concurrent updates from any worker never overwrite each other
+    async with redis.pipeline(transaction=True) as pipe:
+        while True:
+            try:
+                await pipe.watch(key)
+                raw_user = await pipe.get(key)
+                if raw_user is None:
+                    raise HTTPException(status_code=404, detail="User not found")
+                
+                # Validate the merged record, since the read endpoints send
+                # stored JSON as it is without checking it against User
+                user_data = User.model_validate({
+                    **User.model_validate_json(raw_user).model_dump(),
+                    **update_data,
+                    "updated_at": datetime.utcnow(),
+                })
+
+                user_json = user_data.model_dump_json()
+                
+                pipe.multi()
+                pipe.set(key, user_json)
+                pipe.delete(USER_LISTING_KEY)
+                pipe.incr(USER_LISTING_GENERATION_KEY)
+                await pipe.execute()
+                break
+            except WatchError:
+                continue
     
-    return user_data
+    return Response(content=user_json, media_type="application/json")
+
+async def stream_users(redis: aioredis.Redis):
+    # Stored values are already validated single-line User JSON, so they are
+    # emitted as NDJSON lines as they are, one MGET and one chunk per batch
+    async def read_batch(keys):
+        return b"".join(raw + b"\n" for raw in await redis.mget(keys) if raw)
 
-@app.get("/users/", response_model=List[User])
-async def read_users(_: dict = Depends(get_admin_user)):
-    return list(fake_users_db.values())
+    # SCAN may return a key more than once, e.g. while Redis rehashes
+    seen = set()
+    keys = []
+    async for key in redis.scan_iter(match=user_key("*"), count=USER_STREAM_BATCH_SIZE):
+        if key in seen:
+            continue
+        seen.add(key)
+        keys.append(key)
+        if len(keys) >= USER_STREAM_BATCH_SIZE:
+            yield await read_batch(keys)
+            keys = []
+    if keys:
+        yield await read_batch(keys)
+
+async def stream_and_cache_users(redis: aioredis.Redis):
+    generation = await redis.get(USER_LISTING_GENERATION_KEY)
+    chunks = []
+    async for chunk in stream_users(redis):
+        chunks.append(chunk)
+        yield chunk
+
+    # Only store the listing if no user was written since the scan started
+    async with redis.pipeline(transaction=True) as pipe:
+        try:
+            await pipe.watch(USER_LISTING_GENERATION_KEY)
+            if await pipe.get(USER_LISTING_GENERATION_KEY) != generation:
+                return
+            pipe.multi()
+            pipe.set(USER_LISTING_KEY, b"".join(chunks))
+            await pipe.execute()
+        except WatchError:
+            pass
+
+@app.get(
+    "/users/",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}}
+)
+async def read_users(
+    _: dict = Depends(get_admin_user),
+    redis: aioredis.Redis = Depends(get_redis)
+):
+    listing = await redis.get(USER_LISTING_KEY)
+    if listing is not None:
+        return Response(content=listing, media_type="application/x-ndjson")
+    return StreamingResponse(
+        stream_and_cache_users(redis), media_type="application/x-ndjson"
+    )
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8001, reload=True)
\ No newline at end of file
+    # Auto-reload cannot be combined with several workers, use --reload in dev
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8001,
+        workers=int(os.getenv("UVICORN_WORKERS", "4")),
+        loop="uvloop",
+        http="httptools",
+        reload=False
+    )
\ No newline at end of file